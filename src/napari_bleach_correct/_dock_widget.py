@@ -6,7 +6,7 @@ from qtpy.QtWidgets import QVBoxLayout, QWidget, QLabel
 from qtpy.QtCore import Qt
 
 from ._button_grid import ButtonGrid
-from ._widgets import ratio_correct_widget, exponential_correct_widget, histogram_correct_widget
+from ._widgets import ratio_correct_widget, exponential_correct_widget, histogram_correct_widget, apply_recipe_widget
 from ._plot_widget import IntensityPlotWidget
 
 
@@ -29,6 +29,10 @@ CATEGORIES = {
         widget=histogram_correct_widget,
         tool_tip="Matching histograms to the first or neighboring frame"
     ),
+    "Apply Recipe": Category(
+        widget=apply_recipe_widget,
+        tool_tip="Apply the correction of a corrected layer to another layer"
+    ),
     "Plot Mean Intensities": Category(
         widget=IntensityPlotWidget,
         tool_tip="Plot Mean Intensities of two image layers"
@@ -1,5 +1,17 @@
-from ..modules import ratio_correct, exponential_correct, histogram_correct
+from ..modules import (
+    ratio_correct,
+    exponential_correct,
+    histogram_correct,
+    apply_recipe,
+    CorrectionRecipe,
+    dask_ratio_correct,
+    dask_exponential_correct,
+    dask_histogram_correct,
+    dask_apply_recipe,
+)
+import dask.array as da
 import numpy as np
+import pytest
 
 
 def test_ratio():
@@ -21,3 +33,163 @@ def test_histogram():
     corrected = histogram_correct(images, contrast_limits=(0, 1))
 
     assert isinstance(corrected, np.ndarray)
+
+
+@pytest.mark.parametrize("correct, kwargs", [
+    (ratio_correct, {"background_intens": 0.1}),
+    (exponential_correct, {"method": "mono"}),
+    (histogram_correct, {"match": "first"}),
+    (histogram_correct, {"match": "neighbor"}),
+    (ratio_correct, {"per_plane": True}),
+    (exponential_correct, {"method": "mono", "per_plane": True}),
+    (histogram_correct, {"match": "neighbor", "per_plane": True}),
+])
+def test_recipe(correct, kwargs, tmp_path):
+    images = np.random.random((5, 3, 20, 20))
+    corrected, recipe = correct(np.copy(images), contrast_limits=(0, 1), return_recipe=True, **kwargs)
+
+    path = tmp_path / "recipe.npz"
+    recipe.save(path)
+    loaded = CorrectionRecipe.load(path)
+
+    # histogram recipes store transfer functions at a fixed number of quantiles
+    atol = 1e-2 if correct is histogram_correct else 0
+    np.testing.assert_allclose(apply_recipe(images, loaded, contrast_limits=(0, 1)), corrected, atol=atol)
+    np.testing.assert_allclose(apply_recipe(images, recipe.to_dict(), contrast_limits=(0, 1)), corrected, atol=atol)
+
+
+def test_recipe_save_numpy_params(tmp_path):
+    images = np.random.random((5, 20, 20))
+    corrected, recipe = ratio_correct(
+        np.copy(images), contrast_limits=(0, 1), background_intens=np.float32(0.1), return_recipe=True
+    )
+    recipe.params["offset"] = np.arange(2)
+
+    # the `.npz` suffix is appended by `save` and `load`
+    recipe.save(tmp_path / "recipe")
+    loaded = CorrectionRecipe.load(tmp_path / "recipe")
+
+    assert loaded.params["offset"] == [0, 1]
+    np.testing.assert_allclose(apply_recipe(images, loaded, contrast_limits=(0, 1)), corrected)
+
+
+@pytest.mark.parametrize("dtype, contrast_limits", [(np.uint8, (0, 255)), (np.uint16, (0, 65535))])
+@pytest.mark.parametrize("kwargs", [
+    {"match": "first"},
+    {"match": "neighbor"},
+    {"match": "first", "per_plane": True},
+])
+def test_histogram_recipe_integer(dtype, contrast_limits, kwargs):
+    # integer counts with ties and a zero background
+    decay = np.exp(-0.3 * np.arange(6)).reshape(-1, 1, 1, 1)
+    images = np.random.poisson(120 * decay * np.ones((6, 3, 20, 20)))
+    images = (images * (np.random.random(images.shape) > 0.3)).astype(dtype)
+    corrected, recipe = histogram_correct(np.copy(images), contrast_limits, return_recipe=True, **kwargs)
+
+    replayed = apply_recipe(images, recipe, contrast_limits)
+    np.testing.assert_allclose(replayed.astype(float), corrected.astype(float), atol=1)
+
+
+@pytest.mark.parametrize("correct, kwargs", [
+    (ratio_correct, {}),
+    (exponential_correct, {"method": "mono"}),
+    (histogram_correct, {"match": "first"}),
+    (histogram_correct, {"match": "neighbor"}),
+    (histogram_correct, {"match": "neighbor", "per_plane": True}),
+])
+def test_recipe_other_stack(correct, kwargs):
+    decay = np.exp(-0.5 * np.arange(6)).reshape(-1, 1, 1, 1)
+    fitted = np.random.random((6, 3, 20, 20)) * 100 * decay
+    other = 2 * fitted
+    _, recipe = correct(np.copy(fitted), contrast_limits=(0, 1000), return_recipe=True, **kwargs)
+
+    expected = correct(np.copy(other), contrast_limits=(0, 1000), **kwargs)
+    corrected = apply_recipe(other, recipe, contrast_limits=(0, 1000))
+
+    np.testing.assert_allclose(corrected.mean(axis=(1, 2, 3)), expected.mean(axis=(1, 2, 3)), rtol=1e-3)
+    np.testing.assert_allclose(corrected, expected, atol=2)
+
+
+def test_ratio_recipe_contrast_limits():
+    images = np.random.random((5, 20, 20)) * 100
+    _, recipe = ratio_correct(np.copy(images), contrast_limits=(0, 200), background_intens=0.1, return_recipe=True)
+
+    # the background stays at 20 intensity units with other contrast limits
+    expected = apply_recipe(images, recipe, contrast_limits=(0, 200))
+    corrected = apply_recipe(images, recipe, contrast_limits=(0, 1000))
+
+    np.testing.assert_allclose(corrected, expected)
+
+
+@pytest.mark.parametrize("correct", [ratio_correct, exponential_correct, histogram_correct])
+def test_per_plane(correct):
+    images = np.random.random((5, 3, 20, 20))
+    corrected = correct(np.copy(images), contrast_limits=(0, 1), per_plane=True)
+
+    for z in range(images.shape[1]):
+        expected = correct(np.copy(images[:, z]), contrast_limits=(0, 1))
+        np.testing.assert_allclose(corrected[:, z], expected)
+
+
+@pytest.mark.parametrize("correct, dask_correct, kwargs", [
+    (ratio_correct, dask_ratio_correct, {"background_intens": 0.1}),
+    (exponential_correct, dask_exponential_correct, {"method": "mono"}),
+    (histogram_correct, dask_histogram_correct, {"match": "first"}),
+    (ratio_correct, dask_ratio_correct, {"per_plane": True}),
+    (histogram_correct, dask_histogram_correct, {"per_plane": True}),
+])
+def test_dask(correct, dask_correct, kwargs):
+    images = np.random.random((6, 4, 20, 20))
+    expected = correct(np.copy(images), contrast_limits=(0, 1), **kwargs)
+    corrected = dask_correct(da.from_array(images, chunks=(2, 2, 10, 10)), contrast_limits=(0, 1), **kwargs)
+
+    # the chunked mean differs from the numpy mean by rounding errors
+    assert isinstance(corrected, da.Array)
+    np.testing.assert_allclose(corrected.compute(), expected, rtol=1e-5)
+
+
+@pytest.mark.parametrize("per_plane", [False, True])
+def test_dask_histogram_integer(per_plane):
+    # integer counts with ties and a zero background
+    decay = np.exp(-0.3 * np.arange(6)).reshape(-1, 1, 1, 1)
+    images = np.random.poisson(800 * decay * np.ones((6, 4, 20, 20)))
+    images = (images * (np.random.random(images.shape) > 0.3)).astype(np.uint16)
+
+    expected, recipe = histogram_correct(np.copy(images), (0, 65535), per_plane=per_plane, return_recipe=True)
+    corrected, dask_recipe = dask_histogram_correct(
+        da.from_array(images, chunks=(2, 3, 10, 10)), (0, 65535), per_plane=per_plane, return_recipe=True
+    )
+
+    np.testing.assert_array_equal(corrected.compute(), expected)
+    np.testing.assert_allclose(dask_recipe.compute().factors, recipe.factors)
+
+
+def test_dask_apply_recipe():
+    images = np.random.random((6, 20, 20))
+    expected, recipe = histogram_correct(np.copy(images), contrast_limits=(0, 1), match="neighbor", return_recipe=True)
+    corrected = dask_apply_recipe(da.from_array(images, chunks=(2, 10, 10)), recipe, contrast_limits=(0, 1))
+
+    np.testing.assert_allclose(corrected.compute(), apply_recipe(images, recipe, contrast_limits=(0, 1)))
+    np.testing.assert_allclose(corrected.compute(), expected, atol=1e-2)
+
+
+@pytest.mark.parametrize("correct", [ratio_correct, histogram_correct])
+def test_dask_apply_recipe_shape(correct):
+    images = np.random.random((6, 4, 20, 20))
+    _, recipe = correct(np.copy(images), contrast_limits=(0, 1), per_plane=True, return_recipe=True)
+
+    # a recipe fitted on 4 planes can not be applied to 3 planes
+    with pytest.raises(AssertionError):
+        dask_apply_recipe(da.from_array(images[:, :3]), recipe, contrast_limits=(0, 1))
+
+
+def test_dask_distributed():
+    distributed = pytest.importorskip("distributed")
+    images = da.random.random((6, 40, 40), chunks=(2, 20, 20))
+
+    with distributed.LocalCluster(n_workers=2, processes=False) as cluster, distributed.Client(cluster) as client:
+        corrected, recipe = dask_ratio_correct(images, contrast_limits=(0, 1), return_recipe=True)
+        corrected, recipe = client.compute([corrected, recipe], sync=True)
+
+    assert isinstance(corrected, np.ndarray)
+    assert recipe.factors.shape == (6,)
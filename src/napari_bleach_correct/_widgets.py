@@ -5,7 +5,7 @@ from napari.layers import Image
 from napari.types import LayerDataTuple
 from magicgui import magicgui
 
-from napari_bleach_correct.modules import ratio_correct, exponential_correct, histogram_correct
+from napari_bleach_correct.modules import ratio_correct, exponential_correct, histogram_correct, apply_recipe
 
 
 @magicgui(
@@ -18,11 +18,16 @@ from napari_bleach_correct.modules import ratio_correct, exponential_correct, hi
         "min": 0, "max": 1, "step": 0.05,
         "label": "Background Intensity",
         "tooltip": "Estimated background intensity as a normalized value between 0 and 1"
+    },
+    per_plane={
+        "label": "Per Z-Plane",
+        "tooltip": "Correct every Z plane of a 4d stack independently"
     }
 )
 def ratio_correct_widget(
         layer: Image,
-        background_intensity: Optional[float] = None
+        background_intensity: Optional[float] = None,
+        per_plane: bool = False
 ) -> LayerDataTuple:
     """
     Bleaching correction by applying a simple ratio method.
@@ -37,6 +42,8 @@ def ratio_correct_widget(
         4d image stack of shape `N, Z, H, W`.
     background_intensity: float
         Background intensity.
+    per_plane: bool
+        Compute the correction independently for every Z plane of a 4d stack.
 
     Returns
     -------
@@ -50,13 +57,17 @@ def ratio_correct_widget(
     name = layer.name + " Corrected (Ratio Method)"
 
     # store metadata
-    md = layer._metadata
-    md.update({"method": "ratio", "background_intensity": background_intensity})
+    md = layer._metadata.copy()
+    md.update({"method": "ratio", "background_intensity": background_intensity, "per_plane": per_plane})
 
-    corrected = ratio_correct(
+    corrected, recipe = ratio_correct(
         images=data,
         contrast_limits=contrast_limits,
-        background_intens=background_intensity)
+        background_intens=background_intensity,
+        per_plane=per_plane,
+        return_recipe=True)
+
+    md["recipe"] = recipe.to_dict()
 
     return [(corrected, {"metadata": md, "name": name, "colormap": layer.colormap}, layer._type_string)]
 
@@ -71,11 +82,16 @@ def ratio_correct_widget(
         "choices": ["mono", "bi"],
         "label": "Exponential Curve",
         "tooltip": "The type of the exponential curve to use for fitting"
+    },
+    per_plane={
+        "label": "Per Z-Plane",
+        "tooltip": "Correct every Z plane of a 4d stack independently"
     }
 )
 def exponential_correct_widget(
         layer: Image,
-        method: str = "bi"
+        method: str = "bi",
+        per_plane: bool = False
 ) -> LayerDataTuple:
     """
     Drift estimation of fluorescence signal by fitting the mean intensity to an exponential curve.
@@ -98,6 +114,8 @@ def exponential_correct_widget(
         4d image stack of shape `N, Z, H, W`.
     method: str
         Type of exponential curve ("mono" or "bi").
+    per_plane: bool
+        Compute the correction independently for every Z plane of a 4d stack.
 
     Returns
     -------
@@ -111,13 +129,17 @@ def exponential_correct_widget(
     name = layer.name + " Corrected (Exponential Curve Method)"
 
     # store metadata
-    md = layer._metadata
-    md.update({"method": "exponential", "curve_type": method})
+    md = layer._metadata.copy()
+    md.update({"method": "exponential", "curve_type": method, "per_plane": per_plane})
 
-    corrected = exponential_correct(
+    corrected, recipe = exponential_correct(
         images=data,
         contrast_limits=contrast_limits,
-        method=method)
+        method=method,
+        per_plane=per_plane,
+        return_recipe=True)
+
+    md["recipe"] = recipe.to_dict()
 
     return [(corrected, {"metadata": md, "name": name, "colormap": layer.colormap}, layer._type_string)]
 
@@ -132,11 +154,16 @@ def exponential_correct_widget(
         "choices": ["first", "neighbor"],
         "label": "Reference Frame",
         "tooltip": "Match histogram to the first our the neighboring frame"
+    },
+    per_plane={
+        "label": "Per Z-Plane",
+        "tooltip": "Correct every Z plane of a 4d stack independently"
     }
 )
 def histogram_correct_widget(
         layer: Image,
-        match: str = "neighbor"
+        match: str = "neighbor",
+        per_plane: bool = False
 ) -> LayerDataTuple:
     """
     Bleaching correction by matching histograms to a reference image.
@@ -154,6 +181,8 @@ def histogram_correct_widget(
         4d image stack of shape `N, Z, H, W`.
     match: str
         Match frame histogram with 'first' our 'neighbor' histogram.
+    per_plane: bool
+        Compute the correction independently for every Z plane of a 4d stack.
 
     Returns
     -------
@@ -173,12 +202,73 @@ def histogram_correct_widget(
     name = layer.name + " Corrected (Histogram Matching Method)"
 
     # store metadata
-    md = layer._metadata
-    md.update({"method": "histogram", "match": match})
+    md = layer._metadata.copy()
+    md.update({"method": "histogram", "match": match, "per_plane": per_plane})
 
-    corrected = histogram_correct(
+    corrected, recipe = histogram_correct(
         images=np.copy(data),
         contrast_limits=contrast_limits,
-        match=match)
+        match=match,
+        per_plane=per_plane,
+        return_recipe=True)
+
+    md["recipe"] = recipe.to_dict()
+
+    return [(corrected, {"metadata": md, "name": name, "colormap": layer.colormap}, layer._type_string)]
+
+
+@magicgui(
+    call_button="Correct",
+    layer={
+        "label": "Image Layer",
+        "tooltip": "A 3d or 4d image layer in your Viewer"
+    },
+    recipe_layer={
+        "label": "Recipe Layer",
+        "tooltip": "A corrected image layer whose correction should be applied again"
+    }
+)
+def apply_recipe_widget(
+        layer: Image,
+        recipe_layer: Image
+) -> LayerDataTuple:
+    """
+    Apply the correction of a previously corrected layer to another layer.
+
+    The correction recipe (per-frame factors, fit parameters or quantile transfer functions)
+    is read from the metadata of the recipe layer, so no fitting is done.
+    Both layers must have the same number of frames.
+
+    Parameters
+    ----------
+    layer: napari.layers.Image
+        3d image stack of shape `N, H, W` or
+        4d image stack of shape `N, Z, H, W`.
+    recipe_layer: napari.layers.Image
+        Corrected image layer with a correction recipe in its metadata.
+
+    Returns
+    -------
+    napari.types.LayerDataTuple
+        New Image layer with the corrected images.
+    """
+    data = layer.data
+    contrast_limits = layer.contrast_limits
+
+    recipe = recipe_layer._metadata.get("recipe")
+    if recipe is None:
+        raise ValueError(f"Layer '{recipe_layer.name}' has no correction recipe in its metadata")
+
+    # correction name
+    name = layer.name + f" Corrected (Recipe from {recipe_layer.name})"
+
+    # store metadata
+    md = layer._metadata.copy()
+    md.update({"method": recipe["method"], "recipe": recipe})
+
+    corrected = apply_recipe(
+        images=data,
+        recipe=recipe,
+        contrast_limits=contrast_limits)
 
     return [(corrected, {"metadata": md, "name": name, "colormap": layer.colormap}, layer._type_string)]
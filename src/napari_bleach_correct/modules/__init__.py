@@ -1,3 +1,6 @@
 from .exponential import exponential_correct
 from .ratio import ratio_correct
 from .histogram import histogram_correct
+from .recipe import CorrectionRecipe
+from .apply import apply_recipe
+from .dask_correct import dask_ratio_correct, dask_exponential_correct, dask_histogram_correct, dask_apply_recipe
@@ -0,0 +1,53 @@
+from typing import Tuple, Union
+
+from napari.types import ImageData
+
+from .recipe import CorrectionRecipe
+from .ratio import ratio_apply
+from .exponential import exponential_apply
+from .histogram import histogram_apply
+
+
+APPLY_FUNCTIONS = {
+    "ratio": ratio_apply,
+    "exponential": exponential_apply,
+    "histogram": histogram_apply,
+}
+
+
+def apply_recipe(
+        images: ImageData,
+        recipe: Union[CorrectionRecipe, dict],
+        contrast_limits: Tuple[int, int]
+) -> ImageData:
+    """
+    Apply a fitted correction recipe to an image stack without fitting it again.
+
+    Parameters
+    ----------
+    images: numpy.ndarray
+        3d image stack of shape `N, H, W` or
+        4d image stack of shape `N, Z, H, W`.
+    recipe: CorrectionRecipe or dict
+        A recipe returned by one of the correction functions with `return_recipe=True`
+        or its dictionary representation from the layer metadata.
+    contrast_limits: tuple of int
+        Contrast limits of the image stack.
+
+    Returns
+    -------
+    numpy.ndarray
+        Corrected image stack.
+    """
+    if isinstance(recipe, dict):
+        recipe = CorrectionRecipe.from_dict(recipe)
+
+    assert (
+            3 <= len(images.shape) <= 4
+    ), f"Expected 3d or 4d image stack, instead got {len(images.shape)} dimensions"
+
+    if recipe.method not in APPLY_FUNCTIONS:
+        raise NotImplementedError(
+            f"method must be one of {list(APPLY_FUNCTIONS)}, instead got {recipe.method}"
+        )
+    return APPLY_FUNCTIONS[recipe.method](images, recipe, contrast_limits)
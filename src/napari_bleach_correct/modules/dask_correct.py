@@ -0,0 +1,397 @@
+from dataclasses import replace
+from typing import Optional, Tuple, Union
+
+import numpy as np
+import dask
+import dask.array as da
+from dask.delayed import Delayed
+
+from .recipe import CorrectionRecipe
+from .ratio import _ratio_recipe, ratio_apply
+from .exponential import _curve, _exponential_recipe, exponential_apply
+from .histogram import _planes, _ranks, _source_knots, _tables, _apply_tables
+
+
+def _apply_block(
+        block: np.ndarray,
+        recipe: CorrectionRecipe,
+        contrast_limits: Tuple[int, int],
+        block_info=None
+) -> np.ndarray:
+    # position of the block in the whole stack
+    loc = block_info[0]["array-location"]
+
+    if recipe.method == "histogram":
+        dtype = block.dtype
+        per_plane = recipe.params.get("per_plane", False)
+        images = _planes(np.array(block, dtype=float), per_plane)
+
+        # select the quantile tables of the frames (and planes) in this block
+        tables = np.asarray(recipe.factors)[loc[0][0]:loc[0][1]]
+        if per_plane:
+            tables = tables[:, loc[1][0]:loc[1][1]]
+
+        images = _apply_tables(images, tables)
+        images = images.reshape(block.shape)
+        images[images < contrast_limits[0]] = contrast_limits[0]
+        images[images > contrast_limits[1]] = contrast_limits[1]
+        return images.astype(dtype)
+
+    # select the factors of the frames (and planes) in this block
+    factors = np.asarray(recipe.factors)
+    factors = factors[tuple(slice(start, stop) for start, stop in loc[:factors.ndim])]
+    block_recipe = replace(recipe, n_frames=len(factors), factors=factors)
+
+    if recipe.method == "ratio":
+        return ratio_apply(block, block_recipe, contrast_limits)
+    return exponential_apply(block, block_recipe, contrast_limits)
+
+
+def _whole_planes(images: da.Array, per_plane: bool) -> da.Array:
+    # rechunk so that every block holds whole frames (or whole planes)
+    first = 2 if per_plane else 1
+    return images.rechunk({i: -1 for i in range(first, images.ndim)})
+
+
+def _map_recipe(
+        images: da.Array,
+        recipe: Delayed,
+        contrast_limits: Tuple[int, int],
+        method: str,
+        per_plane: bool
+) -> da.Array:
+    # histogram matching needs whole frames (or whole planes) in every block
+    if method == "histogram":
+        images = _whole_planes(images, per_plane)
+
+    return da.map_blocks(
+        _apply_block,
+        images,
+        recipe,
+        contrast_limits,
+        dtype=images.dtype
+    )
+
+
+def _check_images(images, per_plane: bool) -> da.Array:
+    images = da.asarray(images)
+
+    assert (
+            3 <= len(images.shape) <= 4
+    ), f"Expected 3d or 4d image stack, instead got {len(images.shape)} dimensions"
+
+    if per_plane:
+        assert (
+                len(images.shape) == 4
+        ), f"`per_plane` expects a 4d image stack, instead got {len(images.shape)} dimensions"
+    return images
+
+
+def _frame_means(images: da.Array, per_plane: bool) -> da.Array:
+    # tree reduction of every chunk to an `N` or `N, Z` table of mean intensities
+    axes = tuple([i for i in range(len(images.shape))])
+    return da.mean(images, axis=axes[2:] if per_plane else axes[1:])
+
+
+def _block_histograms(block: np.ndarray, per_plane: bool) -> list:
+    # unique values and their counts of every plane in a block of the first frame
+    return [np.unique(row, return_counts=True) for row in _planes(block, per_plane)[0]]
+
+
+def _first_reference(histograms: list, offsets: list, n_planes: int) -> list:
+    # join the histograms of all blocks of the first frame to the unique values
+    # of every plane at the rank of their last pixel
+    joined = [[] for _ in range(n_planes)]
+    for offset, block in zip(offsets, histograms):
+        for p, hist in enumerate(block):
+            joined[offset + p].append(hist)
+
+    reference = []
+    for hists in joined:
+        values, ix = np.unique(np.concatenate([val for val, _ in hists]), return_inverse=True)
+        counts = np.bincount(ix, weights=np.concatenate([cnt for _, cnt in hists]), minlength=len(values))
+        reference.append((np.cumsum(counts), values))
+    return reference
+
+
+def _match_block(
+        block: np.ndarray,
+        reference: list,
+        contrast_limits: Tuple[int, int],
+        per_plane: bool,
+        block_info=None
+) -> np.ndarray:
+    # match every frame (and plane) of a block with whole frames (or planes)
+    # to the unique values of the first frame at the ranks of its pixels
+    loc = block_info[0]["array-location"]
+    first = loc[1][0] if per_plane else 0
+
+    images = _planes(np.array(block), per_plane)
+    ranks = _ranks(images)
+    for p in range(images.shape[1]):
+        ends, values = reference[first + p]
+        images[:, p] = np.interp(ranks[:, p], ends, values)
+
+    images = images.reshape(block.shape)
+    images[images < contrast_limits[0]] = contrast_limits[0]
+    images[images > contrast_limits[1]] = contrast_limits[1]
+    return images.astype(block.dtype)
+
+
+def _block_tables(block: np.ndarray, corrected: np.ndarray, per_plane: bool, n_quantiles: int) -> np.ndarray:
+    # source and corrected quantile tables of every frame (and plane) in the block
+    knots, source = _source_knots(_planes(block, per_plane), n_quantiles)
+    return _tables(knots, source, _planes(corrected, per_plane))
+
+
+def _first_recipe(tables: list, per_plane: bool, n_quantiles: int) -> CorrectionRecipe:
+    # join the `N, P, 3, n_quantiles` tables of all blocks
+    tables = np.concatenate([np.concatenate(row, axis=1) for row in tables], axis=0)
+    return CorrectionRecipe(
+        method="histogram",
+        n_frames=len(tables),
+        params={"match": "first", "per_plane": per_plane, "n_quantiles": n_quantiles},
+        factors=tables
+    )
+
+
+def dask_ratio_correct(
+        images: Union[da.Array, np.ndarray],
+        contrast_limits: Tuple[int, int],
+        background_intens: Optional[float] = None,
+        per_plane: bool = False,
+        return_recipe: bool = False
+) -> Union[da.Array, Tuple[da.Array, Delayed]]:
+    """
+    Lazy version of `ratio_correct` that builds a dask graph.
+
+    Only the mean intensity of every frame (and plane) is reduced and
+    sent to the fit, the correction is applied block by block.
+    Nothing is computed until the returned array is computed or stored,
+    e.g. with `dask.distributed.Client.compute` or `dask.array.to_zarr`.
+
+    Parameters
+    ----------
+    images: dask.array.Array or numpy.ndarray
+        3d image stack of shape `N, H, W` or
+        4d image stack of shape `N, Z, H, W`.
+    contrast_limits: tuple of int
+        Contrast limits of the image stack.
+    background_intens: float, optional
+        Background intensity as a normalized value between 0 and 1.
+    per_plane: bool
+        Compute the correction independently for every Z plane of a 4d stack.
+    return_recipe: bool
+        Also return the correction recipe as a `dask.delayed.Delayed` object.
+
+    Returns
+    -------
+    dask.array.Array
+        Lazily corrected image stack with the chunks of the input.
+    """
+    images = _check_images(images, per_plane)
+
+    if background_intens is not None:
+        assert (
+                0 <= background_intens <= 1
+        ), f"`background_intens` expected to be between 0 and 1, instead got {background_intens}"
+
+    I_mean = _frame_means(images, per_plane)
+    recipe = dask.delayed(_ratio_recipe, pure=True)(I_mean, contrast_limits, background_intens, per_plane)
+    corrected = _map_recipe(images, recipe, contrast_limits, "ratio", per_plane)
+
+    if return_recipe:
+        return corrected, recipe
+    return corrected
+
+
+def dask_exponential_correct(
+        images: Union[da.Array, np.ndarray],
+        contrast_limits: Tuple[int, int],
+        method: str = "mono",
+        per_plane: bool = False,
+        return_recipe: bool = False
+) -> Union[da.Array, Tuple[da.Array, Delayed]]:
+    """
+    Lazy version of `exponential_correct` that builds a dask graph.
+
+    Only the mean intensity of every frame (and plane) is reduced and
+    sent to the curve fit, the correction is applied block by block.
+
+    Parameters
+    ----------
+    images: dask.array.Array or numpy.ndarray
+        3d image stack of shape `N, H, W` or
+        4d image stack of shape `N, Z, H, W`.
+    contrast_limits: tuple of int
+        Contrast limits of the image stack.
+    method: str
+        Type of exponential curve ("mono" or "bi").
+    per_plane: bool
+        Compute the correction independently for every Z plane of a 4d stack.
+    return_recipe: bool
+        Also return the correction recipe as a `dask.delayed.Delayed` object.
+
+    Returns
+    -------
+    dask.array.Array
+        Lazily corrected image stack with the chunks of the input.
+    """
+    images = _check_images(images, per_plane)
+    func = _curve(method)
+
+    I_mean = _frame_means(images, per_plane)
+    recipe = dask.delayed(_exponential_recipe, pure=True)(I_mean, func, method, per_plane)
+    corrected = _map_recipe(images, recipe, contrast_limits, "exponential", per_plane)
+
+    if return_recipe:
+        return corrected, recipe
+    return corrected
+
+
+def dask_histogram_correct(
+        images: Union[da.Array, np.ndarray],
+        contrast_limits: Tuple[int, int],
+        match: str = "first",
+        per_plane: bool = False,
+        return_recipe: bool = False,
+        n_quantiles: int = 1024
+) -> Union[da.Array, Tuple[da.Array, Delayed]]:
+    """
+    Lazy version of `histogram_correct` that builds a dask graph.
+
+    Every frame is matched to the histogram of the first frame with the same result
+    as `histogram_correct(match="first")`. Only the histogram of the first frame
+    (its unique values and their counts) is reduced from its chunks and sent
+    to the other blocks. For integer images it holds at most one entry per
+    intensity value. The image is rechunked so that every block holds whole frames
+    (or whole planes if `per_plane` is set). For the recipe every block is reduced
+    to a table of source and corrected quantiles.
+
+    Matching to the neighboring frame depends on the corrected previous frame and
+    can not be distributed. Fit it with `histogram_correct` on a representative
+    stack instead and apply the recipe to stacks with the same number of frames
+    (and planes) with `dask_apply_recipe`.
+
+    Parameters
+    ----------
+    images: dask.array.Array or numpy.ndarray
+        3d image stack of shape `N, H, W` or
+        4d image stack of shape `N, Z, H, W`.
+    contrast_limits: tuple of int
+        Contrast limits of the image stack.
+    match: str
+        Only 'first' is supported.
+    per_plane: bool
+        Compute the correction independently for every Z plane of a 4d stack.
+    return_recipe: bool
+        Also return the correction recipe as a `dask.delayed.Delayed` object.
+    n_quantiles: int
+        Number of quantile levels of the stored transfer functions.
+
+    Returns
+    -------
+    dask.array.Array
+        Lazily corrected image stack.
+    """
+    images = _check_images(images, per_plane)
+
+    if match != "first":
+        raise NotImplementedError(
+            f"Only 'first' can be used as reference frame with dask, instead got {match}"
+        )
+
+    # histogram of the first frame, reduced chunk by chunk
+    first = images[:1].to_delayed()
+    offsets = np.cumsum((0,) + images.chunks[1])[:-1] if per_plane else [0]
+    histograms, block_offsets = [], []
+    for index in np.ndindex(first.shape):
+        histograms.append(dask.delayed(_block_histograms, pure=True)(first[index], per_plane))
+        block_offsets.append(int(offsets[index[1]]) if per_plane else 0)
+    reference = dask.delayed(_first_reference, pure=True)(
+        histograms, block_offsets, images.shape[1] if per_plane else 1
+    )
+
+    # match blocks of whole frames (or whole planes) to the first frame
+    images = _whole_planes(images, per_plane)
+    corrected = da.map_blocks(
+        _match_block,
+        images,
+        reference,
+        contrast_limits,
+        per_plane,
+        dtype=images.dtype
+    )
+
+    if return_recipe:
+        # one quantile table per block, blocks are indexed by frames (and planes)
+        blocks = images.to_delayed()
+        blocks = blocks.reshape(blocks.shape[0], -1)
+        corrected_blocks = corrected.to_delayed()
+        corrected_blocks = corrected_blocks.reshape(corrected_blocks.shape[0], -1)
+        tables = [
+            [
+                dask.delayed(_block_tables, pure=True)(block, corrected_block, per_plane, n_quantiles)
+                for block, corrected_block in zip(row, corrected_row)
+            ]
+            for row, corrected_row in zip(blocks, corrected_blocks)
+        ]
+        return corrected, dask.delayed(_first_recipe, pure=True)(tables, per_plane, n_quantiles)
+    return corrected
+
+
+def dask_apply_recipe(
+        images: Union[da.Array, np.ndarray],
+        recipe: Union[CorrectionRecipe, dict],
+        contrast_limits: Tuple[int, int]
+) -> da.Array:
+    """
+    Lazily apply a fitted correction recipe to an image stack.
+
+    The recipe is a single node of the graph, so it is sent only once to every worker.
+
+    Parameters
+    ----------
+    images: dask.array.Array or numpy.ndarray
+        3d image stack of shape `N, H, W` or
+        4d image stack of shape `N, Z, H, W`.
+    recipe: CorrectionRecipe or dict
+        A recipe returned by one of the correction functions with `return_recipe=True`
+        or its dictionary representation from the layer metadata.
+    contrast_limits: tuple of int
+        Contrast limits of the image stack.
+
+    Returns
+    -------
+    dask.array.Array
+        Lazily corrected image stack.
+    """
+    if isinstance(recipe, dict):
+        recipe = CorrectionRecipe.from_dict(recipe)
+
+    per_plane = recipe.params.get("per_plane", False)
+    images = _check_images(images, per_plane)
+
+    avail_methods = ["ratio", "exponential", "histogram"]
+    if recipe.method not in avail_methods:
+        raise NotImplementedError(
+            f"method must be one of {avail_methods}, instead got {recipe.method}"
+        )
+
+    assert (
+            recipe.n_frames == images.shape[0]
+    ), f"Recipe was fitted on {recipe.n_frames} frames, instead got {images.shape[0]} frames"
+
+    # check the frames (and planes) before building the graph, like the numpy functions
+    factors = np.asarray(recipe.factors)
+    if recipe.method == "histogram":
+        shape = (images.shape[0], images.shape[1] if per_plane else 1)
+        assert (
+                factors.shape[:2] == shape
+        ), f"Recipe was fitted on frames and planes of shape {factors.shape[:2]}, instead got {shape}"
+    else:
+        assert (
+                factors.shape == images.shape[:factors.ndim]
+        ), f"Recipe was fitted on frames (and planes) of shape {factors.shape}, instead got {images.shape[:factors.ndim]}"
+
+    return _map_recipe(images, dask.delayed(recipe, pure=True), contrast_limits, recipe.method, per_plane)
@@ -1,10 +1,12 @@
-from typing import Tuple
+from typing import Tuple, Union
 import logging
 
 import numpy as np
 from scipy.optimize import curve_fit
 from napari.types import ImageData
 
+from .recipe import CorrectionRecipe
+
 logger = logging.getLogger(__name__)
 logging.basicConfig()
 logger.setLevel(logging.DEBUG)
@@ -18,59 +20,106 @@ def bi_exp(x, a, b, c, d):
     return (a * np.exp(-b * x)) + (c * np.exp(-d * x))
 
 
-def exponential_correct(
-        images: ImageData,
-        contrast_limits: Tuple[int, int],
-        method: str = "mono"
-) -> ImageData:
-    # cache image dtype
-    dtype = images.dtype
-
-    assert (
-            3 <= len(images.shape) <= 4
-    ), f"Expected 3d or 4d image stack, instead got {len(images.shape)} dimensions"
-
-    # choose exponential curve
+def _curve(method: str):
     avail_methods = ["mono", "bi"]
     if method == "mono":
-        func = exp
+        return exp
     elif method == "bi":
-        func = bi_exp
-    else:
-        raise NotImplementedError(
-            f"method must be one of {avail_methods}, instead got {method}"
-        )
+        return bi_exp
+    raise NotImplementedError(
+        f"method must be one of {avail_methods}, instead got {method}"
+    )
 
-    # calculate the mean intensity for every frame
-    # store the intensity from the first frame
-    axes = tuple([i for i in range(len(images.shape))])
-    I_mean = np.mean(images, axis=axes[1:])
 
+def _fit_curve(func, I_mean, method, plane=None):
     # fit curve
-    x_data = np.arange(images.shape[0])
+    x_data = np.arange(len(I_mean))
     with np.errstate(over="ignore"):
         try:
             popt, _ = curve_fit(func, x_data, I_mean)
             # get theoretical values
             f_ = np.vectorize(func)(x_data, *popt)
+            popt = [float(p) for p in popt]
         except (ValueError, RuntimeError, Warning):
             f_ = np.ones(x_data.shape)
+            popt = None
 
     # calculate r squared
     residuals = I_mean - f_
     ss_res = np.sum(residuals ** 2)
     ss_tot = np.sum((I_mean - np.mean(I_mean)) ** 2)
     r_squared = 1 - (ss_res / ss_tot)
-    logger.info(f"R-squared value for fitting a {method}-exponential curve: {r_squared}")
+    plane_info = "" if plane is None else f" to plane {plane}"
+    logger.info(f"R-squared value for fitting a {method}-exponential curve{plane_info}: {r_squared}")
 
     # normalize theoretical data
-    f = f_ / np.max(f_)
+    return f_ / np.max(f_), popt, float(r_squared)
+
 
-    # divide every frame by its ratio
-    if len(images.shape) == 3:
-        f = f.reshape(-1, 1, 1)
+def _exponential_recipe(I_mean: np.ndarray, func, method: str, per_plane: bool) -> CorrectionRecipe:
+    # fit curve for every plane or for the whole frame
+    if per_plane:
+        fits = [_fit_curve(func, I_mean[:, j], method, plane=j) for j in range(I_mean.shape[1])]
+        f = np.stack([fit[0] for fit in fits], axis=1)
+        popt = [fit[1] for fit in fits]
+        r_squared = [fit[2] for fit in fits]
     else:
-        f = f.reshape(-1, 1, 1, 1)
+        f, popt, r_squared = _fit_curve(func, I_mean, method)
+
+    return CorrectionRecipe(
+        method="exponential",
+        n_frames=len(I_mean),
+        params={"curve_type": method, "popt": popt, "r_squared": r_squared, "per_plane": per_plane},
+        factors=f
+    )
+
+
+def exponential_correct(
+        images: ImageData,
+        contrast_limits: Tuple[int, int],
+        method: str = "mono",
+        per_plane: bool = False,
+        return_recipe: bool = False
+) -> Union[ImageData, Tuple[ImageData, CorrectionRecipe]]:
+    assert (
+            3 <= len(images.shape) <= 4
+    ), f"Expected 3d or 4d image stack, instead got {len(images.shape)} dimensions"
+
+    # choose exponential curve
+    func = _curve(method)
+
+    if per_plane:
+        assert (
+                len(images.shape) == 4
+        ), f"`per_plane` expects a 4d image stack, instead got {len(images.shape)} dimensions"
+
+    # calculate the mean intensity for every frame (and plane)
+    axes = tuple([i for i in range(len(images.shape))])
+    I_mean = np.mean(images, axis=axes[2:] if per_plane else axes[1:])
+
+    recipe = _exponential_recipe(I_mean, func, method, per_plane)
+    corrected = exponential_apply(images, recipe, contrast_limits)
+
+    if return_recipe:
+        return corrected, recipe
+    return corrected
+
+
+def exponential_apply(
+        images: ImageData,
+        recipe: CorrectionRecipe,
+        contrast_limits: Tuple[int, int]
+) -> ImageData:
+    # cache image dtype
+    dtype = images.dtype
+
+    factors = np.asarray(recipe.factors)
+    assert (
+            factors.shape == images.shape[:factors.ndim]
+    ), f"Recipe was fitted on frames (and planes) of shape {factors.shape}, instead got {images.shape[:factors.ndim]}"
+
+    # divide every frame (and plane) by its ratio
+    f = factors.reshape(factors.shape + (1,) * (len(images.shape) - factors.ndim))
     images = images / f
 
     # avoid overflow
@@ -1,14 +1,155 @@
-from typing import Tuple
+from typing import Tuple, Union
 
 import numpy as np
 from napari.types import ImageData
 
+from .recipe import CorrectionRecipe
+
+
+def _planes(images: np.ndarray, per_plane: bool) -> np.ndarray:
+    # view the stack as `N, P, pixels` with one plane per Z slice
+    # or a single plane holding the whole volume
+    k = images.shape[0]
+    if per_plane:
+        return images.reshape(k, images.shape[1], -1)
+    return images.reshape(k, 1, -1)
+
+
+def _ranks(rows: np.ndarray) -> np.ndarray:
+    # number of pixels in the row that are smaller or equal to every pixel,
+    # i.e. the cdf of the row times the number of pixels
+    pixel_size = rows.shape[-1]
+    flat_rows = rows.reshape(-1, pixel_size)
+    n_rows = len(flat_rows)
+
+    # integer images with a small range of values are counted instead of sorted
+    if np.issubdtype(rows.dtype, np.integer):
+        lo = int(flat_rows.min())
+        n_values = int(flat_rows.max()) - lo + 1
+        if n_rows * n_values <= rows.size:
+            ix = (flat_rows - lo).astype(np.intp) + np.arange(n_rows)[:, np.newaxis] * n_values
+            counts = np.bincount(ix.ravel(), minlength=n_rows * n_values).reshape(n_rows, n_values)
+            return np.cumsum(counts, axis=1).ravel()[ix].reshape(rows.shape)
+
+    order = np.argsort(flat_rows, axis=-1)
+    sorted_rows = np.take_along_axis(flat_rows, order, axis=-1)
+
+    # the rank of a pixel is the position of the last pixel of its run of equal values,
+    # runs longer than one pixel only need to be handled in rows with ties
+    rank_sorted = np.tile(np.arange(1, pixel_size + 1), (n_rows, 1))
+    is_end = np.ones(flat_rows.shape, dtype=bool)
+    is_end[:, :-1] = sorted_rows[:, 1:] != sorted_rows[:, :-1]
+    tied = np.flatnonzero(~is_end.all(axis=1))
+    if len(tied):
+        run_end = np.where(is_end[tied], rank_sorted[tied], pixel_size)
+        rank_sorted[tied] = np.minimum.accumulate(run_end[:, ::-1], axis=-1)[:, ::-1]
+
+    ranks = np.empty(flat_rows.shape, dtype=int)
+    np.put_along_axis(ranks, order, rank_sorted, axis=-1)
+    return ranks.reshape(rows.shape)
+
+
+def _lookup(rows: np.ndarray) -> np.ndarray:
+    # table of shape `P, pixels + 1` with the matched value for every rank of the
+    # reference rows: unique values at the rank of their last pixel, linearly
+    # interpolated in between and the smallest value below the first rank
+    n_rows, pixel_size = rows.shape
+    sorted_rows = np.sort(rows, axis=-1)
+
+    is_knot = np.ones((n_rows, pixel_size + 1), dtype=bool)
+    is_knot[:, 1:-1] = sorted_rows[:, 1:] != sorted_rows[:, :-1]
+
+    # flatten all rows with an offset of `pixels + 1` to interpolate them at once
+    x = np.arange(n_rows * (pixel_size + 1)).reshape(n_rows, pixel_size + 1)
+    y = np.concatenate([sorted_rows[:, :1], sorted_rows], axis=1)
+    return np.interp(x, x[is_knot], y[is_knot])
+
+
+def _match_ranks(ranks: np.ndarray, lookup: np.ndarray) -> np.ndarray:
+    # match ranks of shape `..., P, pixels` with the lookup table of the `P` reference rows
+    return lookup[np.arange(len(lookup))[:, np.newaxis], ranks]
+
+
+def _knots(sorted_planes: np.ndarray, n_quantiles: int) -> np.ndarray:
+    # indices of `n_quantiles` knots into every sorted row: the last pixel of every
+    # unique value if they fit, otherwise evenly spaced quantile levels with the cdf
+    # convention of `_ranks`: the i-th smallest of `P` pixels is at level (i + 1) / P
+    pixel_size = sorted_planes.shape[-1]
+    levels = np.linspace(0, 1, n_quantiles)
+    even = np.clip(np.ceil(levels * pixel_size) - 1, 0, pixel_size - 1).astype(int)
+
+    is_end = np.ones(sorted_planes.shape, dtype=bool)
+    is_end[..., :-1] = sorted_planes[..., 1:] != sorted_planes[..., :-1]
+    n_unique = is_end.sum(axis=-1, keepdims=True)
+
+    # run ends of every row in their order, padded with the last pixel
+    flat_ends = is_end.reshape(-1, pixel_size)
+    row, col = np.nonzero(flat_ends)
+    order = np.cumsum(flat_ends, axis=-1)[row, col] - 1
+    keep = order < n_quantiles
+    ends = np.full((len(flat_ends), n_quantiles), pixel_size - 1)
+    ends[row[keep], order[keep]] = col[keep]
+    ends = ends.reshape(sorted_planes.shape[:-1] + (n_quantiles,))
+
+    return np.where(n_unique <= n_quantiles, ends, even)
+
+
+def _quantiles(sorted_planes: np.ndarray, levels: np.ndarray) -> np.ndarray:
+    # linearly interpolated quantiles of every sorted row at its own levels
+    pixel_size = sorted_planes.shape[-1]
+    pos = levels * pixel_size - 1
+    pos = np.clip(np.where(np.isclose(pos, np.rint(pos)), np.rint(pos), pos), 0, pixel_size - 1)
+
+    lo = np.floor(pos).astype(int)
+    hi = np.minimum(lo + 1, pixel_size - 1)
+    w = pos - lo
+    return (
+        np.take_along_axis(sorted_planes, lo, axis=-1) * (1 - w)
+        + np.take_along_axis(sorted_planes, hi, axis=-1) * w
+    )
+
+
+def _source_knots(planes: np.ndarray, n_quantiles: int) -> Tuple[np.ndarray, np.ndarray]:
+    # knot indices and source quantiles of every frame (and plane)
+    sorted_planes = np.sort(planes, axis=-1)
+    knots = _knots(sorted_planes, n_quantiles)
+    return knots, np.take_along_axis(sorted_planes, knots, axis=-1)
+
+
+def _tables(knots: np.ndarray, source: np.ndarray, corrected: np.ndarray) -> np.ndarray:
+    # tables of shape `N, P, 3, n_quantiles` with the levels, source and corrected
+    # quantiles of every frame (and plane), the correction keeps the order of the
+    # pixels so the corrected rows are sampled at the same knots as the source rows
+    levels = (knots + 1) / corrected.shape[-1]
+    corrected = np.take_along_axis(np.sort(corrected, axis=-1), knots, axis=-1)
+    return np.stack([levels, source, corrected], axis=2)
+
+
+def _apply_tables(images: np.ndarray, tables: np.ndarray) -> np.ndarray:
+    # map every pixel of frames of shape `N, P, pixels` from the source quantiles
+    # to the corrected quantiles of the recipe, scaled by the ratio between the
+    # quantiles of the frame and the source quantiles where both are above 0
+    levels, source, corrected = tables[:, :, 0], tables[:, :, 1], tables[:, :, 2]
+    target = _quantiles(np.sort(images, axis=-1), levels)
+    scale = np.divide(target, source, out=np.ones(target.shape), where=(source > 0) & (target > 0))
+
+    k, n_planes, pixel_size = images.shape
+    for i in range(k):
+        for p in range(n_planes):
+            gain = np.interp(images[i, p], target[i, p], scale[i, p])
+            images[i, p] = np.interp(images[i, p] / gain, source[i, p], corrected[i, p]) * gain
+
+    return images
+
 
 def histogram_correct(
         images: ImageData,
         contrast_limits: Tuple[int, int],
-        match: str = "first"
-) -> ImageData:
+        match: str = "first",
+        per_plane: bool = False,
+        return_recipe: bool = False,
+        n_quantiles: int = 1024
+) -> Union[ImageData, Tuple[ImageData, CorrectionRecipe]]:
     # cache image dtype
     dtype = images.dtype
 
@@ -16,47 +157,72 @@ def histogram_correct(
             3 <= len(images.shape) <= 4
     ), f"Expected 3d or 4d image stack, instead got {len(images.shape)} dimensions"
 
-    if len(images.shape) == 3:
-        k, m, n = images.shape
-        z = None
-        pixel_size = m * n
-    else:
-        k, z, m, n = images.shape
-        pixel_size = z * m * n
-
     avail_match_methods = ["first", "neighbor"]
     assert (
         match in avail_match_methods
     ), f"'match' expected to be one of {avail_match_methods}, instead got {match}"
 
-    # flatten the last dimensions and calculate normalized cdf
-    images = images.reshape(k, -1)
-    values, cdfs = [], []
+    if per_plane:
+        assert (
+                len(images.shape) == 4
+        ), f"`per_plane` expects a 4d image stack, instead got {len(images.shape)} dimensions"
 
-    for i in range(k):
+    # flatten the last dimensions
+    shape = images.shape
+    images = _planes(images, per_plane)
+    k, n_planes, pixel_size = images.shape
 
-        if i > 0:
-            if match == "first":
-                match_ix = 0
-            else:
-                match_ix = i - 1
+    # source quantiles for the recipe
+    if return_recipe:
+        knots, source = _source_knots(images, n_quantiles)
 
-            val, ix, cnt = np.unique(images[i, ...].flatten(), return_inverse=True, return_counts=True)
-            cdf = np.cumsum(cnt) / pixel_size
+    # one sort for all frames (and planes), every row is matched with
+    # the ranks of its pixels to the unique values of the reference row
+    ranks = _ranks(images)
+    if match == "first":
+        images[1:] = _match_ranks(ranks[1:], _lookup(images[0]))
+    else:
+        # every frame depends on the corrected previous frame
+        for i in range(1, k):
+            images[i] = _match_ranks(ranks[i], _lookup(images[i - 1]))
 
-            interpolated = np.interp(cdf, cdfs[match_ix], values[match_ix])
-            images[i, ...] = interpolated[ix]
+    images = images.reshape(shape)
+    images[images < contrast_limits[0]] = contrast_limits[0]
+    images[images > contrast_limits[1]] = contrast_limits[1]
+    images = images.astype(dtype)
 
-        if i == 0 or match == "neighbor":
-            val, cnt = np.unique(images[i, ...].flatten(), return_counts=True)
-            cdf = np.cumsum(cnt) / pixel_size
-            values.append(val)
-            cdfs.append(cdf)
+    if return_recipe:
+        # transfer function from the source to the corrected quantiles of every frame
+        recipe = CorrectionRecipe(
+            method="histogram",
+            n_frames=k,
+            params={"match": match, "per_plane": per_plane, "n_quantiles": n_quantiles},
+            factors=_tables(knots, source, _planes(images, per_plane))
+        )
+        return images, recipe
+    return images
 
-    if z is None:
-        images = images.reshape(k, m, n)
-    else:
-        images = images.reshape(k, z, m, n)
+
+def histogram_apply(
+        images: ImageData,
+        recipe: CorrectionRecipe,
+        contrast_limits: Tuple[int, int]
+) -> ImageData:
+    # cache image dtype
+    dtype = images.dtype
+
+    shape = images.shape
+    per_plane = recipe.params.get("per_plane", False)
+    images = _planes(np.array(images, dtype=float), per_plane)
+
+    tables = np.asarray(recipe.factors)
+    assert (
+            tables.shape[:2] == images.shape[:2]
+    ), f"Recipe was fitted on frames and planes of shape {tables.shape[:2]}, instead got {images.shape[:2]}"
+
+    images = _apply_tables(images, tables)
+
+    images = images.reshape(shape)
     images[images < contrast_limits[0]] = contrast_limits[0]
     images[images > contrast_limits[1]] = contrast_limits[1]
     return images.astype(dtype)
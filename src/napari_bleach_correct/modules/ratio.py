@@ -1,20 +1,45 @@
-from typing import Optional, Tuple
+from typing import Optional, Tuple, Union
 
 import numpy as np
 from napari.types import ImageData
 
+from .recipe import CorrectionRecipe
 
-def ratio_correct(
-        images: ImageData,
+
+def _ratio_recipe(
+        I_mean: np.ndarray,
         contrast_limits: Tuple[int, int],
-        background_intens: Optional[float] = None
-) -> ImageData:
-    # cache image dtype
-    dtype = images.dtype
+        background_intens: Optional[float],
+        per_plane: bool
+) -> CorrectionRecipe:
+    # scale the mean intensities between 0 and 1
+    # store the intensity from the first frame
+    I_mean = I_mean / contrast_limits[1]
+    I_null = I_mean[0]
 
-    # scale image between 0 and 1
-    images = images / contrast_limits[1]
+    # get the ratio for every frame
+    bg = 0 if background_intens is None else background_intens
+    I_ratio = (I_null - bg) / (I_mean - bg)
+
+    return CorrectionRecipe(
+        method="ratio",
+        n_frames=len(I_mean),
+        params={
+            "background_intens": None if background_intens is None else float(background_intens),
+            "contrast_limits": [float(c) for c in contrast_limits],
+            "per_plane": per_plane
+        },
+        factors=I_ratio
+    )
 
+
+def ratio_correct(
+        images: ImageData,
+        contrast_limits: Tuple[int, int],
+        background_intens: Optional[float] = None,
+        per_plane: bool = False,
+        return_recipe: bool = False
+) -> Union[ImageData, Tuple[ImageData, CorrectionRecipe]]:
     assert (
             3 <= len(images.shape) <= 4
     ), f"Expected 3d or 4d image stack, instead got {len(images.shape)} dimensions"
@@ -24,29 +49,50 @@ def ratio_correct(
                 0 <= background_intens <= 1
         ), f"`background_intens` expected to be between 0 and 1, instead got {background_intens}"
 
-    # calculate the mean intensity for every frame
-    # store the intensity from the first frame
+    if per_plane:
+        assert (
+                len(images.shape) == 4
+        ), f"`per_plane` expects a 4d image stack, instead got {len(images.shape)} dimensions"
+
+    # calculate the mean intensity for every frame (and plane)
     axes = tuple([i for i in range(len(images.shape))])
-    I_mean = np.mean(images, axis=axes[1:])
-    I_null = I_mean[0]
+    I_mean = np.mean(images, axis=axes[2:] if per_plane else axes[1:])
 
-    # get the ratio for every frame
+    recipe = _ratio_recipe(I_mean, contrast_limits, background_intens, per_plane)
+    corrected = ratio_apply(images, recipe, contrast_limits)
+
+    if return_recipe:
+        return corrected, recipe
+    return corrected
+
+
+def ratio_apply(
+        images: ImageData,
+        recipe: CorrectionRecipe,
+        contrast_limits: Tuple[int, int]
+) -> ImageData:
+    # cache image dtype
+    dtype = images.dtype
+
+    factors = np.asarray(recipe.factors)
+    assert (
+            factors.shape == images.shape[:factors.ndim]
+    ), f"Recipe was fitted on frames (and planes) of shape {factors.shape}, instead got {images.shape[:factors.ndim]}"
+
+    background_intens = recipe.params.get("background_intens")
     if background_intens is None:
         background_intens = 0
-    I_ratio = (I_null - background_intens) / (I_mean - background_intens)
+
+    # the background is normalized by the contrast limits of the fitted stack
+    fitted_limits = recipe.params.get("contrast_limits", contrast_limits)
+    background = background_intens * fitted_limits[1]
 
     # subtract background from every pixel
-    images = images - background_intens
+    images = images - background
 
-    # multiply every frame by its ratio
-    if len(images.shape) == 3:
-        I_ratio = I_ratio.reshape(-1, 1, 1)
-    else:
-        I_ratio = I_ratio.reshape(-1, 1, 1, 1)
+    # multiply every frame (and plane) by its ratio and avoid overflow
+    I_ratio = factors.reshape(factors.shape + (1,) * (len(images.shape) - factors.ndim))
     images = I_ratio * images
-
-    # rescale and avoid overflow
-    images = images * contrast_limits[1]
     images[images < contrast_limits[0]] = contrast_limits[0]
     images[images > contrast_limits[1]] = contrast_limits[1]
     return images.astype(dtype)
@@ -0,0 +1,111 @@
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Any, Dict, Optional
+import json
+
+import numpy as np
+
+
+def _to_builtin(value: Any) -> Any:
+    # convert numpy scalars and arrays in the parameters to plain python types for json
+    if isinstance(value, dict):
+        return {k: _to_builtin(v) for k, v in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [_to_builtin(v) for v in value]
+    if isinstance(value, (np.generic, np.ndarray)):
+        return value.tolist()
+    return value
+
+
+def _npz_path(path) -> Path:
+    # `np.savez` appends `.npz` to paths without it
+    path = Path(path)
+    if path.suffix != ".npz":
+        path = path.with_name(path.name + ".npz")
+    return path
+
+
+@dataclass
+class CorrectionRecipe:
+    """
+    Serializable description of a fitted bleaching correction.
+
+    A recipe holds everything that is needed to apply a correction to a stack
+    without fitting it again, so that a correction can be fitted once on a
+    representative channel and applied to many other stacks.
+
+    Parameters
+    ----------
+    method: str
+        Correction method ("ratio", "exponential" or "histogram").
+    n_frames: int
+        Number of frames of the stack the recipe was fitted on.
+    params: dict
+        Method parameters and fit results, e.g. the background intensity and contrast limits
+        of the fitted stack, the curve type and the fitted curve parameters or the reference frame.
+    factors: numpy.ndarray, optional
+        Per-frame factors. For the ratio method every frame is multiplied by its factor,
+        for the exponential method every frame is divided by the normalized fitted curve.
+        For histogram matching these are tables of shape `N, P, 3, n_quantiles` with the levels,
+        the source and the corrected quantiles of every frame and plane.
+        Every pixel is mapped from the source to the corrected quantiles.
+    """
+    method: str
+    n_frames: int
+    params: Dict[str, Any] = field(default_factory=dict)
+    factors: Optional[np.ndarray] = None
+
+    def to_dict(self) -> dict:
+        """
+        Convert the recipe to a dictionary, e.g. to store it in layer metadata.
+        """
+        return {
+            "method": self.method,
+            "n_frames": self.n_frames,
+            "params": dict(self.params),
+            "factors": self.factors,
+        }
+
+    @classmethod
+    def from_dict(cls, d: dict) -> "CorrectionRecipe":
+        """
+        Create a recipe from a dictionary created by `to_dict`.
+        """
+        factors = d.get("factors")
+        return cls(
+            method=d["method"],
+            n_frames=int(d["n_frames"]),
+            params=dict(d.get("params", {})),
+            factors=None if factors is None else np.asarray(factors),
+        )
+
+    def save(self, path) -> None:
+        """
+        Save the recipe as a `.npz` file, the suffix is appended if it is missing.
+        """
+        arrays = {
+            "header": np.array(json.dumps({
+                "method": self.method,
+                "n_frames": int(self.n_frames),
+                "params": _to_builtin(self.params),
+            })),
+        }
+        if self.factors is not None:
+            arrays["factors"] = np.asarray(self.factors)
+        np.savez(_npz_path(path), **arrays)
+
+    @classmethod
+    def load(cls, path) -> "CorrectionRecipe":
+        """
+        Load a recipe from a `.npz` file created by `save`.
+        """
+        with np.load(_npz_path(path), allow_pickle=False) as f:
+            header = json.loads(str(f["header"]))
+            factors = f["factors"] if "factors" in f.files else None
+
+        return cls(
+            method=header["method"],
+            n_frames=header["n_frames"],
+            params=header["params"],
+            factors=factors,
+        )